@@ -0,0 +1,243 @@
+import asyncio
+from urllib.parse import urlsplit, urlunsplit, urldefrag, parse_qsl, urlencode
+import orjson
+import re
+import hashlib
+from dataclasses import dataclass, field
+from typing import BinaryIO
+
+MAX_PARALLEL_PAGES = 6
+
+BLOCKED_HOSTS = ("doubleclick.net", "googletagmanager.com", "google-analytics.com", "facebook.net", "hotjar.com", "segment.com", "segment.io")
+
+# File extensions standing in for Playwright resource types when blocking by URL pattern
+RESOURCE_EXTENSIONS = {
+    "image": ("png", "jpg", "jpeg", "gif", "webp", "avif", "svg", "ico", "bmp"),
+    "font": ("woff", "woff2", "ttf", "otf", "eot"),
+    "media": ("mp4", "webm", "ogg", "mp3", "wav", "m4a", "mov"),
+    "stylesheet": ("css",),
+}
+
+TRACKING_PARAMS = re.compile(r'^(utm_\w+|fbclid|gclid|mc_cid|mc_eid)$')
+
+def canonicalize_url(url):
+    """Normalize a URL so that equivalent spellings share one visited key"""
+    parts = urlsplit(url)
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not TRACKING_PARAMS.match(key)
+    ))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/') or '/', query, ''))
+
+def index_links(urls):
+    """Dedupe links by canonical key, keeping document order and the first spelling seen
+
+    The key is only for claimed/visited lookups; the value is what gets fetched,
+    so servers still see their own query strings and trailing slashes.
+    """
+    links = {}
+    for url in urls:
+        try:
+            links.setdefault(canonicalize_url(url), urldefrag(url).url)
+        except ValueError:  # Malformed URL, e.g. a broken IPv6 host
+            continue
+    return links
+
+class UrlBloomFilter:
+    """Set-like "already seen?" check for URLs backed by a fixed 2 MB bit array
+    
+    Two hashes over 2**24 bits keep false positives under 0.1% up to ~250k
+    URLs; a false positive means one link is never queued, which
+    lost_to_filter() reports once the crawl has drained.
+    """
+    
+    def __init__(self, size_bits=1 << 24):
+        self.mask = size_bits - 1
+        self.bits = bytearray(size_bits >> 3)
+        self.count = 0
+    
+    def _slots(self, url):
+        digest = hashlib.blake2b(url.encode(), digest_size=16).digest()
+        return (int.from_bytes(digest[:8], 'little') & self.mask,
+                int.from_bytes(digest[8:], 'little') & self.mask)
+    
+    def __contains__(self, url):
+        return all(self.bits[i >> 3] & (1 << (i & 7)) for i in self._slots(url))
+    
+    def __len__(self):
+        return self.count
+    
+    def add(self, url):
+        slots = self._slots(url)
+        if all(self.bits[i >> 3] & (1 << (i & 7)) for i in slots):
+            return
+        for i in slots:
+            self.bits[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+@dataclass
+class CrawlState:
+    """Everything the workers of one crawl share; a fresh instance per main() call keeps runs independent"""
+    base_url: str
+    max_depth: int
+    out: BinaryIO
+    # Every link ever seen is checked against claimed, so it lives in a fixed-size filter.
+    # visited is checked after a page has been fetched, where a false positive would drop
+    # finished work; it only grows with pages actually crawled, so it stays an exact set
+    claimed: UrlBloomFilter = field(default_factory=UrlBloomFilter)  # Queued at least once (checked at enqueue time)
+    visited: set = field(default_factory=set)  # Tasks that have run (requested URL) and pages crawled (final URL)
+    unconfirmed: set = field(default_factory=set)  # Filter hits not yet in visited: still queued, or false positives
+    queue: asyncio.Queue = field(default_factory=asyncio.Queue)
+    semaphore: asyncio.Semaphore = field(default_factory=lambda: asyncio.Semaphore(MAX_PARALLEL_PAGES))
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    stats: dict = field(default_factory=lambda: {'total': 0, 'successful': 0, 'errors': 0, 'aliases': 0, 'with_content': 0, 'preview': []})
+    
+    def __post_init__(self):
+        self.base_prefix = self.base_url + '/'
+
+def lost_to_filter(state):
+    """URLs the claimed filter rejected that were never crawled (its false positives)
+
+    Only meaningful once the queue has drained: by then every real claim has
+    run and is in visited, so whatever else the filter turned away was lost.
+    """
+    return sorted(state.unconfirmed - state.visited)
+
+def save_page(state, record):
+    """Append a page record to the NDJSON sitemap and update the running totals"""
+    stats = state.stats
+    state.out.write(orjson.dumps(record) + b"\n")
+    state.out.flush()
+    stats['total'] += 1
+    if record.get('error', False):
+        stats['errors'] += 1
+        return
+    if 'aliasOf' in record:  # A redirect onto a page recorded under its own URL
+        stats['aliases'] += 1
+        return
+    stats['successful'] += 1
+    if record.get('hasContent', False):
+        stats['with_content'] += 1
+    if len(stats['preview']) < 10:  # Keep the first 10 pages for the summary
+        stats['preview'].append(record)
+
+def blocked_url_patterns(blocked_types):
+    """CDP URL patterns for tracker hosts and the file types of the given resource types"""
+    patterns = []
+    for host in BLOCKED_HOSTS:
+        patterns += [f"*://{host}/*", f"*://*.{host}/*"]
+    for resource_type in blocked_types:
+        for extension in RESOURCE_EXTENSIONS[resource_type]:
+            patterns += [f"*.{extension}", f"*.{extension}?*"]
+    return patterns
+
+async def block_heavy_resources(page, patterns):
+    """Abort requests that never contribute links or page metadata
+
+    Blocking happens in the browser's network stack instead of through
+    page.route(): Playwright disables the HTTP cache whenever routing is
+    on, which would defeat the persistent profile. The CDP session must
+    stay attached for the block list to remain active.
+    """
+    cdp = await page.context.new_cdp_session(page)
+    await cdp.send("Network.enable")
+    await cdp.send("Network.setBlockedURLs", {"urls": patterns})
+    return cdp
+
+async def ensure_live_page(current, crashed, open_page):
+    """Return the worker's (page, network_quiet) pair if the page can still load URLs,
+    otherwise replace it with a fresh pair from open_page()
+    
+    A worker keeps its page for the whole crawl, so a crashed renderer or a
+    closed page would otherwise fail every task the worker pulls afterwards.
+    """
+    page = current[0] if current else None
+    if page is not None and not page.is_closed() and page not in crashed:
+        return current
+    
+    if page is not None:
+        print("    Worker page crashed or was closed, opening a fresh one")
+        crashed.discard(page)
+        try:
+            await page.close()
+        except Exception:
+            pass
+    
+    current = await open_page()
+    current[0].on("crash", crashed.add)
+    return current
+
+# In-page helper spliced into scroll scripts: settle(quietMs) resolves once the document
+# height has held still for quietMs (or after maxMs). Only scrollHeight is watched, so
+# carousels, tickers and animated attributes do not keep it waiting
+SETTLE_HEIGHT_JS = '''
+    const settle = async (quietMs, maxMs = 3000) => {
+        const start = performance.now();
+        let height = document.body.scrollHeight;
+        let stableSince = start;
+        while (performance.now() - stableSince < quietMs && performance.now() - start < maxMs) {
+            await new Promise(resolve => setTimeout(resolve, 50));
+            if (document.body.scrollHeight !== height) {
+                height = document.body.scrollHeight;
+                stableSince = performance.now();
+            }
+        }
+    };
+'''
+
+async def wait_for_resources_settled(page, quiet_ms=250, timeout=2000):
+    """Wait until no resource has finished loading for quiet_ms"""
+    try:
+        await page.wait_for_function(
+            """(quietMs) => {
+                const entries = performance.getEntriesByType('resource');
+                const lastEnd = entries.reduce((latest, entry) => Math.max(latest, entry.responseEnd), 0);
+                return performance.now() - lastEnd > quietMs;
+            }""",
+            arg=quiet_ms,
+            polling=100,
+            timeout=timeout
+        )
+    except Exception:
+        pass
+
+async def watch_lifecycle(page):
+    """Follow the main frame's CDP lifecycle events from before the page's first navigation
+    
+    Returns an Event that is set once the current document's network is almost
+    idle, or None when lifecycle events are unavailable.
+    """
+    quiet = asyncio.Event()
+    try:
+        cdp = await page.context.new_cdp_session(page)
+        frame_tree = await cdp.send("Page.getFrameTree")
+        main_frame_id = frame_tree['frameTree']['frame']['id']
+        
+        def on_lifecycle(event):
+            if event['frameId'] != main_frame_id:
+                return
+            if event['name'] == 'init':  # A new document started loading
+                quiet.clear()
+            elif event['name'] == 'networkAlmostIdle':
+                quiet.set()
+        
+        cdp.on("Page.lifecycleEvent", on_lifecycle)
+        await cdp.send("Page.enable")
+        await cdp.send("Page.setLifecycleEventsEnabled", {"enabled": True})
+    except Exception as e:
+        print(f"    Lifecycle events unavailable: {e}")
+        return None
+    return quiet
+
+async def wait_for_lifecycle_quiet(quiet, cap=5.0):
+    """Wait until the current document's network is almost idle (at most 2 connections for 500 ms), capped
+    
+    quiet is the Event from watch_lifecycle(). Returns at once when that already
+    happened, e.g. after a client-side route change.
+    """
+    if quiet is None:
+        return
+    try:
+        await asyncio.wait_for(quiet.wait(), cap)
+    except asyncio.TimeoutError:
+        pass
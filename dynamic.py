@@ -1,14 +1,28 @@
 import asyncio
+import os
 from urllib.parse import urlparse, urljoin
 from playwright.async_api import async_playwright
-import json
+import orjson
 import time
-import re
+from dataclasses import dataclass
+from crawl_common import (
+    MAX_PARALLEL_PAGES, SETTLE_HEIGHT_JS, CrawlState, canonicalize_url, index_links, lost_to_filter, save_page,
+    blocked_url_patterns, block_heavy_resources, ensure_live_page, watch_lifecycle,
+    wait_for_resources_settled, wait_for_lifecycle_quiet
+)
 
-visited = set()
-sitemap = []
+# Each site gets its own profile below this directory, so cookies and storage never
+# leak between crawled sites and the two crawlers never contend for one profile lock
+DEFAULT_PROFILE_DIR = "./.pw-profile/spa"
 
-async def wait_for_spa_content(page, timeout=45):
+# Stylesheets stay allowed: SPA menus and the hasContent check depend on CSS visibility
+BLOCKED_URL_PATTERNS = blocked_url_patterns({"image", "font", "media"})
+
+@dataclass
+class SpaCrawlState(CrawlState):
+    interact: bool = False  # Hover nav items on each page to reveal dynamic menus
+
+async def wait_for_spa_content(page, quiet, timeout=45):
     """Enhanced waiting for SPA content with multiple strategies"""
     print("    Waiting for SPA content to load...")
     start_time = time.time()
@@ -48,153 +62,222 @@ async def wait_for_spa_content(page, timeout=45):
         )
     ]
     
-    # Try each strategy
-    for i, strategy in enumerate(strategies):
-        try:
-            await strategy()
-            print(f"    Strategy {i+1} succeeded")
-            break
-        except Exception as e:
-            print(f"    Strategy {i+1} failed: {str(e)[:50]}...")
-            continue
-    
-    # Additional wait for any lazy content
-    await asyncio.sleep(3)
+    # Race the strategies; the first one to succeed wins and the rest are cancelled
+    tasks = [asyncio.create_task(strategy()) for strategy in strategies]
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=10, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                print("    All strategies timed out")
+                break
+            succeeded = [t for t in done if not t.exception()]
+            if succeeded:
+                print(f"    Strategy {tasks.index(succeeded[0])+1} succeeded")
+                break
+            for t in done:
+                print(f"    Strategy {tasks.index(t)+1} failed: {str(t.exception())[:50]}...")
+    finally:
+        for t in pending:
+            t.cancel()
     
-    # Wait for network to be quiet
+    # Make sure late scripts and lazy content have finished loading
     try:
-        await page.wait_for_load_state('networkidle', timeout=15000)
-    except:
+        await page.wait_for_function("document.readyState === 'complete'", timeout=2000)
+    except Exception:
         pass
+    
+    # Wait for page lifecycle activity to settle (networkidle never fires on ad-heavy pages)
+    await wait_for_lifecycle_quiet(quiet)
+
+# Scroll through the page to fire intersection observers, optionally hovering nav items
+TRIGGER_SPA_NAVIGATION_JS = '''
+    async (interact) => {''' + SETTLE_HEIGHT_JS + '''
+        // Scroll down half a viewport at a time to trigger lazy loading, moving on
+        // as soon as the page height stops changing
+        for (let i = 0; i < 5; i++) {
+            window.scrollBy(0, window.innerHeight / 2);
+            await settle(100);
+        }
+        
+        // Scroll back to top; resources requested by the scroll are awaited afterwards
+        window.scrollTo(0, 0);
+        
+        // Try to trigger any hover effects or dynamic menus. Most SPAs expose their
+        // routes as plain <a href> already, so this is opt-in and capped
+        if (interact) {
+            const interactiveElements = document.querySelectorAll('nav a, .menu a, button, [role="button"]');
+            for (let el of Array.from(interactiveElements).slice(0, 10)) {
+                el.dispatchEvent(new Event('mouseenter'));
+            }
+            await settle(200);
+        }
+    }
+'''
 
-async def trigger_spa_navigation(page):
+async def trigger_spa_navigation(page, interact=False):
     """Trigger SPA navigation by simulating user interactions"""
     try:
-        # Scroll to trigger any intersection observers
-        await page.evaluate("""
-            async () => {
-                const delay = ms => new Promise(resolve => setTimeout(resolve, ms));
-                
-                // Scroll down slowly to trigger lazy loading
-                for (let i = 0; i < 5; i++) {
-                    window.scrollBy(0, window.innerHeight / 2);
-                    await delay(500);
-                }
-                
-                // Scroll back to top
-                window.scrollTo(0, 0);
-                await delay(1000);
-                
-                // Try to trigger any hover effects or dynamic menus
-                const interactiveElements = document.querySelectorAll('nav a, .menu a, button, [role="button"]');
-                for (let el of interactiveElements) {
-                    el.dispatchEvent(new Event('mouseenter'));
-                    el.dispatchEvent(new Event('focus'));
-                    await delay(100);
-                }
-            }
-        """)
+        await page.evaluate(TRIGGER_SPA_NAVIGATION_JS, interact)
     except Exception as e:
         print(f"    Navigation trigger failed: {e}")
 
-async def extract_spa_links(page, base_url):
-    """Enhanced link extraction for SPAs"""
-    await asyncio.sleep(2)  # Wait for any final rendering
+# Page info and SPA links in one pass; baseUrl is passed as the evaluate argument
+EXTRACT_PAGE_DATA_JS = r'''
+    (baseUrl) => {
+        // Try multiple selectors for title
+        const title = document.title || 
+                    document.querySelector('h1')?.textContent ||
+                    document.querySelector('[data-testid="title"]')?.textContent ||
+                    document.querySelector('.title')?.textContent ||
+                    'No title found';
+        
+        // Try multiple selectors for description
+        const description = document.querySelector('meta[name="description"]')?.content ||
+                          document.querySelector('meta[property="og:description"]')?.content ||
+                          document.querySelector('.description')?.textContent ||
+                          document.querySelector('p')?.textContent?.substring(0, 160) ||
+                          '';
+        
+        const links = new Set();
+        
+        // Standard href links
+        document.querySelectorAll('a[href]').forEach(el => {
+            const href = el.getAttribute('href');
+            if (href && href !== '#' && !href.startsWith('mailto:') && !href.startsWith('tel:')) {
+                links.add(href);
+            }
+        });
+        
+        // React Router style links (data attributes)
+        document.querySelectorAll('[data-href], [data-to], [data-url]').forEach(el => {
+            const href = el.getAttribute('data-href') || el.getAttribute('data-to') || el.getAttribute('data-url');
+            if (href) links.add(href);
+        });
+        
+        // Look for navigation items with onclick handlers
+        document.querySelectorAll('nav *[onclick], .nav *[onclick], .menu *[onclick]').forEach(el => {
+            const onclick = el.getAttribute('onclick');
+            if (onclick) {
+                const pathMatch = onclick.match(/['"](\/[^'"]*)['"]/);
+                if (pathMatch) links.add(pathMatch[1]);
+            }
+        });
+        
+        // Check for programmatic navigation patterns
+        const scripts = Array.from(document.querySelectorAll('script')).map(s => s.textContent);
+        const allScriptText = scripts.join(' ');
+        const routePaths = allScriptText.match(/['"](\/[a-zA-Z0-9\-_\/]*)['"]/g) || [];
+        routePaths.forEach(path => {
+            const cleanPath = path.replace(/['"]/g, '');
+            if (cleanPath.startsWith('/') && cleanPath.length > 1 && !cleanPath.includes(' ')) {
+                links.add(cleanPath);
+            }
+        });
+        
+        // Convert to absolute URLs
+        const absoluteLinks = Array.from(links).map(link => {
+            try {
+                return new URL(link, document.baseURI).href;
+            } catch (e) {
+                return null;
+            }
+        }).filter(link => {
+            return link &&
+                   link.startsWith(baseUrl + '/') && 
+                   !link.includes('?') &&
+                   link !== baseUrl + '/';
+        });
+        
+        // Serialize in-page: one JSON string crosses CDP and orjson decodes it in Python
+        return JSON.stringify({
+            info: {
+                title: title.trim(),
+                description: description.trim(),
+                url: window.location.href,
+                hasContent: document.body.innerText.trim().length > 100
+            },
+            links: [...new Set(absoluteLinks)]
+        });
+    }
+'''
+
+async def extract_page_data(page, base_url):
+    """Extract page information and SPA links in a single evaluate round-trip"""
+    result = orjson.loads(await page.evaluate(EXTRACT_PAGE_DATA_JS, base_url))
     
-    links = await page.evaluate(f'''
-        () => {{
-            const baseUrl = "{base_url}";
-            const currentPath = window.location.pathname;
-            const links = new Set();
-            
-            // Standard href links
-            document.querySelectorAll('a[href]').forEach(el => {{
-                const href = el.getAttribute('href');
-                if (href && href !== '#' && !href.startsWith('mailto:') && !href.startsWith('tel:')) {{
-                    links.add(href);
-                }}
-            }});
-            
-            // React Router style links (data attributes)
-            document.querySelectorAll('[data-href], [data-to], [data-url]').forEach(el => {{
-                const href = el.getAttribute('data-href') || el.getAttribute('data-to') || el.getAttribute('data-url');
-                if (href) links.add(href);
-            }});
-            
-            // Look for navigation items with onclick handlers
-            document.querySelectorAll('nav *[onclick], .nav *[onclick], .menu *[onclick]').forEach(el => {{
-                const onclick = el.getAttribute('onclick');
-                if (onclick) {{
-                    const pathMatch = onclick.match(/['"](\/[^'"]*)['"]/);
-                    if (pathMatch) links.add(pathMatch[1]);
-                }}
-            }});
-            
-            // Check for programmatic navigation patterns
-            const scripts = Array.from(document.querySelectorAll('script')).map(s => s.textContent);
-            const allScriptText = scripts.join(' ');
-            const routePaths = allScriptText.match(/['"](\/[a-zA-Z0-9\-_\/]*)['"]/g) || [];
-            routePaths.forEach(path => {{
-                const cleanPath = path.replace(/['"]/g, '');
-                if (cleanPath.startsWith('/') && cleanPath.length > 1 && !cleanPath.includes(' ')) {{
-                    links.add(cleanPath);
-                }}
-            }});
-            
-            // Convert to absolute URLs
-            const absoluteLinks = Array.from(links).map(link => {{
-                if (link.startsWith('http')) return link;
-                if (link.startsWith('/')) return baseUrl + link;
-                return baseUrl + '/' + link;
-            }}).filter(link => {{
-                return link.startsWith(baseUrl) && 
-                       !link.includes('#') && 
-                       !link.includes('?') &&
-                       link !== baseUrl &&
-                       link !== baseUrl + '/';
-            }});
-            
-            return [...new Set(absoluteLinks)];
-        }}
-    ''')
+    page_info = result['info']
+    # Ordered dedupe: document order decides which links make the per-page cap
+    links = index_links(result['links'])
     
-    # Also try to find links mentioned in the page source/JavaScript
-    try:
-        page_content = await page.content()
-        # Look for route definitions in JavaScript
-        route_patterns = [
-            r'["\']/([\w\-/]+)["\']',  # Path strings
-            r'path:\s*["\']/([\w\-/]+)["\']',  # Route definitions
-            r'to=["\']/([\w\-/]+)["\']',  # React Router to prop
-        ]
+    return page_info, links
+
+# Framework route tables exposed on window (Next.js build manifest, Vue/Nuxt router)
+ROUTE_MANIFEST_JS = '''
+    () => {
+        // Next.js: the build manifest lists every page of the app
+        if (window.__BUILD_MANIFEST?.sortedPages) {
+            return window.__BUILD_MANIFEST.sortedPages;
+        }
         
-        for pattern in route_patterns:
-            matches = re.findall(pattern, page_content)
-            for match in matches:
-                if match and not match.startswith('http'):
-                    potential_url = f"{base_url}/{match}".replace('//', '/')
-                    if potential_url.startswith(base_url):
-                        links.append(potential_url)
-    except:
-        pass
+        // Nuxt 2 / Nuxt 3 / Vue 3 apps: ask the router for its flattened route records
+        const router = window.$nuxt?.$router ||
+                       document.querySelector('#__nuxt, [data-v-app]')?.__vue_app__?.config.globalProperties.$router;
+        if (router?.getRoutes) {
+            return router.getRoutes().map(route => route.path);
+        }
+        
+        return null;
+    }
+'''
+
+async def extract_route_manifest(page, base_url):
+    """Read the framework's own route table (Next.js build manifest, Vue/Nuxt router) if the page exposes one"""
+    try:
+        routes = await page.evaluate(ROUTE_MANIFEST_JS)
+    except Exception as e:
+        print(f"    Route manifest lookup failed: {e}")
+        return {}
     
-    return list(set(links))
+    # Skip framework internals (/_app, /_error) and parameterized routes (/[slug], /:id, catch-alls)
+    return index_links(
+        urljoin(base_url, route)
+        for route in routes or []
+        if route.startswith('/') and not route.startswith('/_') and not any(c in route for c in '[:*')
+    )
 
-async def navigate_spa_route(page, url):
+# Click the first link pointing at targetUrl (absolute or path form)
+CLICK_ROUTE_LINK_JS = '''
+    (targetUrl) => {
+        const targetPath = new URL(targetUrl).pathname;
+        
+        const links = document.querySelectorAll('a[href], [data-href], [data-to]');
+        for (let link of links) {
+            const href = link.getAttribute('href') || link.getAttribute('data-href') || link.getAttribute('data-to');
+            if (href && (href === targetPath || href === targetUrl)) {
+                link.click();
+                return true;
+            }
+        }
+        return false;
+    }
+'''
+
+async def navigate_spa_route(page, quiet, url):
     """Handle SPA route navigation"""
     try:
-        current_url = page.url.rstrip('/')
-        target_url = url.rstrip('/')
+        current_url = page.url
+        target_key = canonicalize_url(url)
         
-        if current_url == target_url:
+        if canonicalize_url(current_url) == target_key:
             return True
             
-        print(f"    Navigating from {current_url} to {target_url}")
+        print(f"    Navigating from {current_url} to {url}")
         
         # Try direct navigation first
         try:
-            await page.goto(url, wait_until='networkidle', timeout=30000)
-            await wait_for_spa_content(page)
+            await page.goto(url, wait_until='domcontentloaded', timeout=15000)
+            await wait_for_spa_content(page, quiet)
             return True
         except Exception as e:
             print(f"    Direct navigation failed: {e}")
@@ -202,26 +285,15 @@ async def navigate_spa_route(page, url):
         # Try clicking a link if direct navigation fails
         try:
             # Look for a link that matches this URL
-            link_clicked = await page.evaluate(f'''
-                () => {{
-                    const targetUrl = "{url}";
-                    const targetPath = new URL(targetUrl).pathname;
-                    
-                    const links = document.querySelectorAll('a[href], [data-href], [data-to]');
-                    for (let link of links) {{
-                        const href = link.getAttribute('href') || link.getAttribute('data-href') || link.getAttribute('data-to');
-                        if (href && (href === targetPath || href === targetUrl)) {{
-                            link.click();
-                            return true;
-                        }}
-                    }}
-                    return false;
-                }}
-            ''')
+            link_clicked = await page.evaluate(CLICK_ROUTE_LINK_JS, url)
             
             if link_clicked:
-                await asyncio.sleep(2)
-                await wait_for_spa_content(page)
+                try:
+                    # Compare canonical forms so a click landing on /about/ matches /about
+                    await page.wait_for_url(lambda page_url: canonicalize_url(page_url) == target_key, timeout=2000)
+                except Exception:
+                    pass
+                await wait_for_spa_content(page, quiet)
                 return True
                 
         except Exception as e:
@@ -233,85 +305,99 @@ async def navigate_spa_route(page, url):
         print(f"    Navigation error: {e}")
         return False
 
-async def crawl_spa(context, base_url, current_url, depth=0, max_depth=2):
-    if (current_url in visited or 
-        not current_url.startswith(base_url) or 
-        depth > max_depth):
-        return
-    
+async def crawl_spa(page, quiet, state, current_url, depth, from_manifest):
     print(f"{'  '*depth}📍 Crawling SPA: {current_url} (depth: {depth})")
-    visited.add(current_url)
-    
-    page = await context.new_page()
-    
-    # Configure page for SPA
-    page.set_default_timeout(45000)
-    page.set_default_navigation_timeout(45000)
-    
-    # Add console logging for debugging
-    page.on("console", lambda msg: print(f"    🔍 Console: {msg.text}") if "error" in msg.text.lower() else None)
     
     try:
         # Navigate to the page
-        success = await navigate_spa_route(page, current_url)
+        success = await navigate_spa_route(page, quiet, current_url)
         if not success:
             raise Exception("Failed to navigate to SPA route")
         
-        # Trigger any dynamic content loading
-        await trigger_spa_navigation(page)
+        # Pages taken from the route manifest are already known; skip discovery interactions
+        if not from_manifest:
+            # Trigger any dynamic content loading
+            await trigger_spa_navigation(page, state.interact)
+            
+            # Wait for resources requested by the interactions to finish
+            await wait_for_resources_settled(page)
         
-        # Wait a bit more for everything to settle
-        await asyncio.sleep(2)
+        # Extract page information and links for further crawling
+        page_info, links = await extract_page_data(page, state.base_url)
         
-        # Extract page information
-        page_info = await page.evaluate('''
-            () => {
-                // Try multiple selectors for title
-                const title = document.title || 
-                            document.querySelector('h1')?.textContent ||
-                            document.querySelector('[data-testid="title"]')?.textContent ||
-                            document.querySelector('.title')?.textContent ||
-                            'No title found';
-                
-                // Try multiple selectors for description
-                const description = document.querySelector('meta[name="description"]')?.content ||
-                                  document.querySelector('meta[property="og:description"]')?.content ||
-                                  document.querySelector('.description')?.textContent ||
-                                  document.querySelector('p')?.textContent?.substring(0, 160) ||
-                                  '';
-                
-                return {
-                    title: title.trim(),
-                    description: description.trim(),
-                    url: window.location.href,
-                    hasContent: document.body.innerText.trim().length > 100
-                };
-            }
-        ''')
+        # Redirects can land several claimed URLs on one page; record and expand it only once
+        final_url = page_info.get('url') or current_url
+        final_key = canonicalize_url(final_url)
+        requested_key = canonicalize_url(current_url)
+        async with state.lock:
+            already_crawled = final_key in state.visited
+            state.visited.add(final_key)
+            state.claimed.add(final_key)
         
-        sitemap.append({
-            "url": current_url,
+        if already_crawled:
+            if final_key == requested_key:
+                # Crawled concurrently through a redirect from another URL; nothing new to record
+                return
+            print(f"{'  '*depth}↪️  {current_url} resolves to already crawled {final_url}")
+            save_page(state, {
+                "url": current_url,
+                "aliasOf": final_url,
+                "depth": depth,
+                "timestamp": time.time()
+            })
+            return
+        
+        record = {
+            "url": final_url,
             "title": page_info.get('title', 'No title'),
             "description": page_info.get('description', ''),
             "depth": depth,
             "hasContent": page_info.get('hasContent', False),
             "timestamp": time.time()
-        })
+        }
+        if final_key != requested_key:
+            record["requestedUrl"] = current_url
+        save_page(state, record)
         
-        # Extract links for further crawling
-        links = await extract_spa_links(page, base_url)
-        unique_links = [link for link in set(links) if link not in visited]
+        # Children past max_depth are never claimed: a claim made here would hide the URL
+        # from a slower, shallower page that reaches it at a legal depth
+        if depth >= state.max_depth:
+            return
         
-        print(f"{'  '*depth}🔗 Found {len(unique_links)} new links to crawl")
+        # A framework route manifest lists every page in one shot; queue them all
+        routes = await extract_route_manifest(page, state.base_url) if depth == 0 else {}
+        if routes:
+            print(f"🗺️  Found route manifest with {len(routes)} routes")
+        
+        # Bind the filter's lookups once per page instead of once per link
+        def _accept(key, base_prefix=state.base_prefix, claimed=state.claimed,
+                    visited=state.visited, unconfirmed=state.unconfirmed):
+            if not key.startswith(base_prefix):
+                return False
+            if key in claimed:
+                if key not in visited:
+                    unconfirmed.add(key)  # Still queued, or a filter false positive; settled at the end
+                return False
+            return True
         
-        # Crawl child pages
-        for link in unique_links[:10]:  # Limit to prevent infinite crawling
-            if link not in visited and base_url in link:
-                await crawl_spa(context, base_url, link, depth + 1, max_depth)
+        async with state.lock:
+            for key, route in routes.items():
+                if _accept(key):
+                    state.claimed.add(key)
+                    state.queue.put_nowait((route, depth + 1, True))
+            
+            unique_links = [(key, link) for key, link in links.items() if _accept(key)]
+            
+            # Queue child pages; claim them now so no other worker fetches them twice
+            for key, link in unique_links[:10]:  # Limit to prevent infinite crawling
+                state.claimed.add(key)
+                state.queue.put_nowait((link, depth + 1, False))
+        
+        print(f"{'  '*depth}🔗 Found {len(unique_links)} new links to crawl")
     
     except Exception as e:
         print(f"{'  '*depth}❌ Error crawling {current_url}: {e}")
-        sitemap.append({
+        save_page(state, {
             "url": current_url,
             "title": "Error loading page",
             "description": str(e),
@@ -319,82 +405,153 @@ async def crawl_spa(context, base_url, current_url, depth=0, max_depth=2):
             "error": True,
             "timestamp": time.time()
         })
+
+async def open_worker_page(context):
+    """Open a page configured for SPA crawling, with its network-quiet Event"""
+    page = await context.new_page()
+    
+    # Skip heavy files and trackers; only markup and scripts matter for link discovery
+    await block_heavy_resources(page, BLOCKED_URL_PATTERNS)
+    
+    # Attach before any navigation so the load's lifecycle events are all seen
+    quiet = await watch_lifecycle(page)
+    
+    # Configure page for SPA
+    page.set_default_timeout(45000)
+    page.set_default_navigation_timeout(45000)
+    
+    # Add console logging for debugging
+    page.on("console", lambda msg: print(f"    🔍 Console: {msg.text}") if "error" in msg.text.lower() else None)
     
+    return page, quiet
+
+async def worker(context, state):
+    """Pull (url, depth, from_manifest) tasks off the shared queue until cancelled, reusing one page"""
+    current = None  # This worker's (page, network_quiet) pair
+    crashed = set()  # Pages whose renderer died; they stay open but can no longer load anything
+    try:
+        while True:
+            current_url, depth, from_manifest = await state.queue.get()
+            try:
+                # A redirect from another claimed URL may already have crawled this page
+                if canonicalize_url(current_url) in state.visited:
+                    continue
+                async with state.semaphore:
+                    try:
+                        current = await ensure_live_page(current, crashed, lambda: open_worker_page(context))
+                    except Exception as e:
+                        print(f"❌ Could not open a page for {current_url}: {e}")
+                        save_page(state, {
+                            "url": current_url,
+                            "title": "Error loading page",
+                            "description": str(e),
+                            "depth": depth,
+                            "error": True,
+                            "timestamp": time.time()
+                        })
+                        continue
+                    page, quiet = current
+                    await crawl_spa(page, quiet, state, current_url, depth, from_manifest)
+            finally:
+                state.visited.add(canonicalize_url(current_url))
+                state.queue.task_done()
     finally:
-        await page.close()
+        if current is not None:
+            await current[0].close()
 
-async def main(start_url, max_depth=2):
+async def main(start_url, max_depth=2, profile_dir=DEFAULT_PROFILE_DIR, interact=False):
     parsed_url = urlparse(start_url)
-    base_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
+    base_url = f"{parsed_url.scheme}://{parsed_url.netloc.lower()}"
     
     print(f"🚀 Starting SPA crawl of: {start_url}")
     print(f"🎯 Base URL: {base_url}")
     print(f"📊 Max depth: {max_depth}")
     print("=" * 60)
     
-    async with async_playwright() as p:
-        # Launch browser with SPA-friendly settings
-        browser = await p.chromium.launch(
-            headless=True,
-            args=[
-                '--disable-blink-features=AutomationControlled',
-                '--disable-dev-shm-usage',
-                '--no-sandbox',
-                '--disable-setuid-sandbox',
-                '--disable-extensions',
-                '--disable-gpu',
-                '--enable-features=NetworkService,NetworkServiceLogging',
-                '--disable-features=TranslateUI,VizDisplayCompositor'
-            ]
-        )
-        
-        # Create context optimized for SPAs
-        context = await browser.new_context(
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            viewport={'width': 1920, 'height': 1080},
-            ignore_https_errors=True,
-            java_script_enabled=True
-        )
-        
-        # Enable request interception for debugging
-        # await context.route("**/*", lambda route: route.continue_())
-        
-        await crawl_spa(context, base_url, start_url, max_depth=max_depth)
-        await browser.close()
+    output_file = "spa_sitemap.ndjson"
     
-    # Save results
-    output_file = "spa_sitemap.json"
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(sitemap, f, indent=2, ensure_ascii=False)
+    # Stream one JSON record per page so memory stays flat however large the crawl gets
+    with open(output_file, "wb") as out:
+        async with async_playwright() as p:
+            # Launch browser with SPA-friendly settings; the persistent profile keeps DNS,
+            # HTTP and service-worker caches warm across runs (resources are blocked per page
+            # over CDP rather than routed, because routing would switch the HTTP cache off)
+            context = await p.chromium.launch_persistent_context(
+                os.path.join(profile_dir, parsed_url.netloc.lower().replace(':', '_')),
+                headless=True,
+                args=[
+                    '--disable-blink-features=AutomationControlled',
+                    '--disable-dev-shm-usage',
+                    '--no-sandbox',
+                    '--blink-settings=imagesEnabled=false',  # Also catches images without a file extension
+                    '--disable-setuid-sandbox',
+                    '--disable-extensions',
+                    '--disable-gpu',
+                    '--enable-features=NetworkService,NetworkServiceLogging',
+                    '--disable-features=TranslateUI,VizDisplayCompositor'
+                ],
+                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                viewport={'width': 1920, 'height': 1080},
+                ignore_https_errors=True,
+                java_script_enabled=True
+            )
+            
+            # Workers open their own configured pages; the blank startup page would only hold a renderer
+            for blank_page in list(context.pages):
+                await blank_page.close()
+            
+            state = SpaCrawlState(base_url, max_depth, out, interact=interact)
+            state.claimed.add(canonicalize_url(start_url))
+            state.queue.put_nowait((start_url, 0, False))
+            
+            workers = [
+                asyncio.create_task(worker(context, state))
+                for _ in range(MAX_PARALLEL_PAGES)
+            ]
+            await state.queue.join()
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            
+            await context.close()
     
+    stats = state.stats
     print("\n" + "=" * 60)
     print(f"✅ SPA crawl completed!")
-    print(f"📁 Total pages discovered: {len(sitemap)}")
+    print(f"📁 Total pages discovered: {stats['total']}")
     print(f"💾 Results saved to: {output_file}")
     
     # Print summary
-    successful_pages = [p for p in sitemap if not p.get('error', False)]
-    error_pages = [p for p in sitemap if p.get('error', False)]
-    pages_with_content = [p for p in successful_pages if p.get('hasContent', False)]
+    print(f"✅ Successful: {stats['successful']}")
+    print(f"📄 With content: {stats['with_content']}")
+    print(f"↪️  Aliases: {stats['aliases']}")
+    print(f"❌ Errors: {stats['errors']}")
     
-    print(f"✅ Successful: {len(successful_pages)}")
-    print(f"📄 With content: {len(pages_with_content)}")
-    print(f"❌ Errors: {len(error_pages)}")
+    lost = lost_to_filter(state)
+    if lost:
+        print(f"⚠️  Skipped by URL filter false positives: {len(lost)}")
+        for url in lost[:10]:
+            print(f"  {url}")
     
     print("\n📋 Pages found:")
-    for page in successful_pages[:10]:  # Show first 10 pages
+    for page in stats['preview']:  # Show first 10 pages
         content_indicator = "📄" if page.get('hasContent') else "📋"
         print(f"  {content_indicator} {page['url']} - {page['title']}")
     
-    if len(successful_pages) > 10:
-        print(f"  ... and {len(successful_pages) - 10} more pages")
+    if stats['successful'] > 10:
+        print(f"  ... and {stats['successful'] - 10} more pages")
 
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) < 2:
-        print("Usage: python spa_crawler.py <URL> [max_depth]")
-        print("Example: python spa_crawler.py https://chetan.pro 2")
-    else:
-        url = sys.argv[1]
-        max_depth = int(sys.argv[2]) if len(sys.argv) > 2 else 2
-        asyncio.run(main(url, max_depth))
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Crawl a single page application and save its sitemap",
+        epilog="Example: python spa_crawler.py https://chetan.pro 2"
+    )
+    parser.add_argument("url", help="URL to start crawling from")
+    parser.add_argument("max_depth", nargs="?", type=int, default=2, help="maximum link depth (default: 2)")
+    parser.add_argument("--profile-dir", default=DEFAULT_PROFILE_DIR,
+                        help=f"directory holding one browser profile per site, reused between crawls (default: {DEFAULT_PROFILE_DIR})")
+    parser.add_argument("--interact", action="store_true",
+                        help="hover the first nav items on each page to reveal dynamic menus")
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.max_depth, args.profile_dir, args.interact))
\ No newline at end of file
@@ -1,257 +1,439 @@
 import asyncio
+import os
 from urllib.parse import urlparse, urljoin
 from playwright.async_api import async_playwright
-import json
-import time
+from selectolax.lexbor import LexborHTMLParser
+import httpx
+import orjson
+from dataclasses import dataclass
+from crawl_common import (
+    MAX_PARALLEL_PAGES, SETTLE_HEIGHT_JS, CrawlState, canonicalize_url, index_links, lost_to_filter, save_page,
+    blocked_url_patterns, block_heavy_resources, ensure_live_page, watch_lifecycle,
+    wait_for_resources_settled, wait_for_lifecycle_quiet
+)
 
-visited = set()
-sitemap = []
+# Each site gets its own profile below this directory, so cookies and storage never
+# leak between crawled sites and the two crawlers never contend for one profile lock
+DEFAULT_PROFILE_DIR = "./.pw-profile/static"
 
-async def wait_for_dynamic_content(page, max_wait=30):
-    """Wait for dynamic content to load by monitoring DOM changes"""
-    start_time = time.time()
-    previous_link_count = 0
-    stable_count = 0
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+# Switch to plain HTTP fetches when the raw HTML of the start page already
+# carries at least this share of the same-site links the browser rendered
+HTTP_LINK_RATIO = 0.9
+
+# Plain HTTP fetches only parse HTML documents up to this size
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+MAX_HTML_BYTES = 5 * 1024 * 1024
+
+BLOCKED_URL_PATTERNS = blocked_url_patterns({"image", "font", "media", "stylesheet"})
+
+@dataclass
+class SiteCrawlState(CrawlState):
+    client: httpx.AsyncClient = None
+    use_http: bool = False  # Set once the start page proves the site is server-rendered
+
+async def wait_for_dynamic_content(page, quiet):
+    """Wait for the first links or the app's root element to render"""
+    # One short capped wait: pages with neither never stall for long
+    try:
+        await page.wait_for_function(
+            "() => document.querySelector('a[href], main, article, #root, #app, #__next, #___gatsby, [data-reactroot]')",
+            timeout=5000
+        )
+    except Exception:
+        pass
     
-    while time.time() - start_time < max_wait:
-        # Wait for any pending network requests
-        try:
-            await page.wait_for_load_state('networkidle', timeout=5000)
-        except:
-            pass
-        
-        # Count current links
-        current_link_count = await page.evaluate('document.querySelectorAll("a[href]").length')
-        
-        # Check if link count has stabilized
-        if current_link_count == previous_link_count:
-            stable_count += 1
-            if stable_count >= 3:  # Content seems stable
-                break
-        else:
-            stable_count = 0
-            previous_link_count = current_link_count
+    await wait_for_lifecycle_quiet(quiet)
+
+# Scroll a viewport at a time until the page stops growing
+SMART_SCROLL_JS = '''
+    async () => {''' + SETTLE_HEIGHT_JS + '''
+        // Scroll a viewport at a time to trigger lazy loading, until the page stops growing
+        // (capped at 10 rounds so infinite feeds terminate)
+        let lastHeight = 0;
+        for (let round = 0; round < 10 && document.body.scrollHeight > lastHeight; round++) {
+            lastHeight = document.body.scrollHeight;
+            while (window.scrollY + window.innerHeight < lastHeight) {
+                const previousY = window.scrollY;
+                window.scrollBy(0, window.innerHeight);
+                if (window.scrollY === previousY) break;  // Page is not scrollable
+                await settle(100);
+            }
+            await settle(500);
+        }
         
-        await asyncio.sleep(1)
+        // Scroll back to top
+        window.scrollTo(0, 0);
+    }
+'''
 
 async def smart_scroll(page):
     """Enhanced scrolling for dynamic content loading"""
-    await page.evaluate("""
-        async () => {
-            const delay = ms => new Promise(resolve => setTimeout(resolve, ms));
-            
-            // Scroll to trigger lazy loading
-            const scrollStep = 300;
-            const scrollDelay = 500;
-            let lastHeight = document.body.scrollHeight;
-            let currentHeight = 0;
-            
-            while (currentHeight < lastHeight) {
-                window.scrollBy(0, scrollStep);
-                currentHeight += scrollStep;
-                await delay(scrollDelay);
-                
-                // Check if new content loaded
-                const newHeight = document.body.scrollHeight;
-                if (newHeight > lastHeight) {
-                    lastHeight = newHeight;
-                }
-            }
-            
-            // Scroll back to top
-            window.scrollTo(0, 0);
-            await delay(1000);
-        }
-    """)
+    await page.evaluate(SMART_SCROLL_JS)
 
-async def extract_links_comprehensive(page, base_url):
-    """Extract links with better filtering for SPAs"""
-    # Wait a bit more for any remaining dynamic content
-    await asyncio.sleep(2)
+# Page info and links in one pass, serialized in-page
+EXTRACT_PAGE_DATA_JS = '''
+    () => {
+        const links = Array.from(document.querySelectorAll('a[href]'))
+            .map(el => el.href)
+            .filter(href => {
+                if (!href || href === '#' || href === 'javascript:void(0)') return false;
+                if (href.includes('mailto:') || href.includes('tel:')) return false;
+                if (href.includes('#') && !href.split('#')[0]) return false; // Pure hash links
+                return true;
+            });
+        
+        // Also look for data-* attributes that might contain URLs (common in SPAs)
+        const dataLinks = Array.from(document.querySelectorAll('[data-href], [data-url], [data-link]'))
+            .map(el => el.getAttribute('data-href') || el.getAttribute('data-url') || el.getAttribute('data-link'))
+            .filter(href => href && href.startsWith('http'));
+        
+        // Serialize in-page: one JSON string crosses CDP and orjson decodes it in Python
+        return JSON.stringify({
+            info: {
+                title: document.title,
+                description: document.querySelector('meta[name="description"]')?.content || '',
+                url: window.location.href
+            },
+            links: [...new Set([...links, ...dataLinks])]
+        });
+    }
+'''
+
+async def extract_page_data(page, base_url):
+    """Extract page info and links with better filtering for SPAs in one evaluate round-trip"""
+    result = orjson.loads(await page.evaluate(EXTRACT_PAGE_DATA_JS))
     
-    links = await page.evaluate('''
-        () => {
-            const links = Array.from(document.querySelectorAll('a[href]'))
-                .map(el => el.href)
-                .filter(href => {
-                    if (!href || href === '#' || href === 'javascript:void(0)') return false;
-                    if (href.includes('mailto:') || href.includes('tel:')) return false;
-                    if (href.includes('#') && !href.split('#')[0]) return false; // Pure hash links
-                    return true;
-                });
-            
-            // Also look for data-* attributes that might contain URLs (common in SPAs)
-            const dataLinks = Array.from(document.querySelectorAll('[data-href], [data-url], [data-link]'))
-                .map(el => el.getAttribute('data-href') || el.getAttribute('data-url') || el.getAttribute('data-link'))
-                .filter(href => href && href.startsWith('http'));
-            
-            return [...new Set([...links, ...dataLinks])];
-        }
-    ''')
+    # Resolve relative URLs and drop non-HTTP ones
+    absolute_links = []
+    for link in result['links']:
+        if link.startswith('/'):
+            link = urljoin(base_url, link)
+        elif not link.startswith('http'):
+            continue
+        absolute_links.append(link)
     
-    # Normalize and filter links
-    normalized_links = []
-    for link in links:
-        try:
-            # Handle relative URLs
-            if link.startswith('/'):
-                link = urljoin(base_url, link)
-            elif not link.startswith('http'):
-                continue
-            
-            # Remove fragments
-            if '#' in link:
-                link = link.split('#')[0]
-            
-            # Remove trailing slashes for consistency
-            link = link.rstrip('/')
-            
-            normalized_links.append(link)
-        except:
+    return result['info'], index_links(absolute_links)
+
+async def fetch_http(client, url):
+    """Fetch a server-rendered page without the browser and extract its info and links"""
+    # Stream the body so same-site PDFs, archives and images are rejected from their headers
+    async with client.stream('GET', url) as response:
+        response.raise_for_status()
+        content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+        if content_type not in HTML_CONTENT_TYPES:
+            raise Exception(f"Not an HTML page ({content_type or 'no content type'})")
+        
+        body = bytearray()
+        async for chunk in response.aiter_bytes():
+            body += chunk
+            if len(body) > MAX_HTML_BYTES:
+                raise Exception(f"HTML page larger than {MAX_HTML_BYTES} bytes")
+    
+    page_url = str(response.url)
+    # A charset in the Content-Type header wins; otherwise lexbor sniffs the BOM or <meta charset>
+    charset = response.charset_encoding
+    if charset:
+        tree = LexborHTMLParser(bytes(body).decode(charset, errors='replace'))
+    else:
+        tree = LexborHTMLParser(bytes(body), encoding=True)
+    
+    title = tree.css_first('title')
+    description = tree.css_first('meta[name="description"]')
+    page_info = {
+        "title": title.text(strip=True) if title else '',
+        "description": (description.attributes.get('content') or '') if description else '',
+        "url": page_url
+    }
+    
+    # Resolve hrefs the way the browser does, against <base href> when the page sets one
+    base = tree.css_first('base[href]')
+    base_href = urljoin(page_url, base.attributes.get('href') or '') if base else page_url
+    
+    links = []
+    for node in tree.css('a[href]'):
+        href = node.attributes.get('href')
+        if not href or href.startswith(('#', 'mailto:', 'tel:', 'javascript:')):
             continue
+        links.append(urljoin(base_href, href))
+    
+    # Also look for data-* attributes that might contain URLs (common in SPAs)
+    for node in tree.css('[data-href], [data-url], [data-link]'):
+        href = node.attributes.get('data-href') or node.attributes.get('data-url') or node.attributes.get('data-link')
+        if href and href.startswith('http'):
+            links.append(href)
     
-    return list(set(normalized_links))
+    return page_info, index_links(links)
+
+# First link whose href contains linkPath (the path is passed as an argument, never spliced into a selector)
+FIND_ROUTE_LINK_JS = '''
+    (linkPath) => Array.from(document.querySelectorAll('a[href]')).find(a => a.getAttribute('href').includes(linkPath))
+'''
 
-async def handle_spa_navigation(page, url):
+async def handle_spa_navigation(page, quiet, url):
     """Handle Single Page Application navigation"""
     try:
         # For SPAs, try clicking navigation instead of direct navigation
         current_url = page.url
         if current_url != url:
             # Try to find and click the link
-            link_selector = f'a[href*="{url.replace(current_url.split("/")[0] + "//" + current_url.split("/")[2], "")}"]'
+            link_path = url.replace(current_url.split("/")[0] + "//" + current_url.split("/")[2], "")
             try:
-                await page.click(link_selector, timeout=5000)
-                await page.wait_for_load_state('networkidle', timeout=10000)
+                link = await page.wait_for_function(FIND_ROUTE_LINK_JS, arg=link_path, timeout=5000)
+                await link.as_element().click()
+                await wait_for_dynamic_content(page, quiet)
                 return True
             except:
                 # Fall back to direct navigation
-                await page.goto(url, timeout=60000, wait_until='networkidle')
+                await page.goto(url, timeout=15000, wait_until='domcontentloaded')
                 return True
     except:
         return False
     return True
 
-async def crawl(context, base_url, current_url, depth=0, max_depth=3):
-    if (current_url in visited or 
-        not current_url.startswith(base_url) or 
-        depth > max_depth):
+async def probe_http_fast_path(state, url, rendered_links):
+    """Enable plain HTTP crawling when the raw HTML carries the links the browser rendered"""
+    try:
+        _, http_links = await fetch_http(state.client, url)
+    except Exception as e:
+        print(f"HTTP probe failed, staying on the browser: {e}")
         return
     
+    # Compare the links themselves: a raw page full of other links must not pass on count alone
+    # A start page with no same-site links proves nothing either way; stay on the browser
+    rendered = {link for link in rendered_links if link.startswith(state.base_prefix)}
+    found = rendered.intersection(http_links)
+    if rendered and len(found) >= HTTP_LINK_RATIO * len(rendered):
+        state.use_http = True
+        print(f"Raw HTML has {len(found)}/{len(rendered)} rendered same-site links, switching to HTTP fetches")
+
+async def crawl(page, quiet, state, current_url, depth):
     print(f"{'  '*depth}Crawling: {current_url} (depth: {depth})")
-    visited.add(current_url)
-    
-    page = await context.new_page()
-    
-    # Set longer timeouts for dynamic content
-    page.set_default_timeout(60000)
-    page.set_default_navigation_timeout(60000)
     
     try:
-        # Navigate to page
-        await page.goto(current_url, wait_until='networkidle', timeout=60000)
-        
-        # Wait for dynamic content
-        await wait_for_dynamic_content(page)
-        
-        # Enhanced scrolling for lazy-loaded content
-        await smart_scroll(page)
+        if state.use_http:
+            # Server-rendered site: plain HTTP already carries the links
+            page_info, links = await fetch_http(state.client, current_url)
+        else:
+            # Navigate to page
+            await page.goto(current_url, wait_until='domcontentloaded', timeout=15000)
+            
+            # Wait for dynamic content
+            await wait_for_dynamic_content(page, quiet)
+            
+            # Enhanced scrolling for lazy-loaded content
+            await smart_scroll(page)
+            
+            # Wait for resources requested by lazy-loaded content to finish
+            await wait_for_resources_settled(page)
+            
+            # Extract page info and links
+            page_info, links = await extract_page_data(page, state.base_url)
+            
+            # Probe the start page: if the raw HTML has (nearly) the same links, skip the browser from here on
+            if depth == 0:
+                await probe_http_fast_path(state, current_url, links)
         
-        # Additional wait for any final rendering
-        await asyncio.sleep(3)
+        # Redirects can land several claimed URLs on one page; record and expand it only once
+        final_url = page_info.get('url') or current_url
+        final_key = canonicalize_url(final_url)
+        requested_key = canonicalize_url(current_url)
+        async with state.lock:
+            already_crawled = final_key in state.visited
+            state.visited.add(final_key)
+            state.claimed.add(final_key)
         
-        # Extract page info
-        page_info = await page.evaluate('''
-            () => ({
-                title: document.title,
-                description: document.querySelector('meta[name="description"]')?.content || '',
-                url: window.location.href
+        if already_crawled:
+            if final_key == requested_key:
+                # Crawled concurrently through a redirect from another URL; nothing new to record
+                return
+            print(f"{'  '*depth}{current_url} resolves to already crawled {final_url}")
+            save_page(state, {
+                "url": current_url,
+                "aliasOf": final_url,
+                "depth": depth
             })
-        ''')
+            return
         
-        sitemap.append({
-            "url": current_url,
+        record = {
+            "url": final_url,
             "title": page_info.get('title', ''),
             "description": page_info.get('description', ''),
             "depth": depth
-        })
-        
-        # Extract links
-        links = await extract_links_comprehensive(page, base_url)
+        }
+        if final_key != requested_key:
+            record["requestedUrl"] = current_url
+        save_page(state, record)
         
         print(f"{'  '*depth}Found {len(links)} links")
         
-        # Crawl child pages
-        for link in links:
-            if link not in visited and base_url in link:
-                await crawl(context, base_url, link, depth + 1, max_depth)
+        # Children past max_depth are never claimed: a claim made here would hide the URL
+        # from a slower, shallower page that reaches it at a legal depth
+        if depth >= state.max_depth:
+            return
+        
+        # Bind the filter's lookups once per page instead of once per link
+        def _accept(key, base_prefix=state.base_prefix, claimed=state.claimed,
+                    visited=state.visited, unconfirmed=state.unconfirmed):
+            if not key.startswith(base_prefix):
+                return False
+            if key in claimed:
+                if key not in visited:
+                    unconfirmed.add(key)  # Still queued, or a filter false positive; settled at the end
+                return False
+            return True
+        
+        # Queue child pages; claim them now so no other worker fetches them twice
+        async with state.lock:
+            for key, link in [(key, link) for key, link in links.items() if _accept(key)]:
+                state.claimed.add(key)
+                state.queue.put_nowait((link, depth + 1))
     
     except Exception as e:
         print(f"[ERROR] {current_url}: {e}")
-        sitemap.append({
+        save_page(state, {
             "url": current_url,
             "title": "Error loading page",
             "description": str(e),
             "depth": depth,
             "error": True
         })
+
+async def open_worker_page(context):
+    """Open a page configured for crawling dynamic content, with its network-quiet Event"""
+    page = await context.new_page()
     
+    # Skip heavy files and trackers; only markup and scripts matter for link discovery
+    await block_heavy_resources(page, BLOCKED_URL_PATTERNS)
+    
+    # Attach before any navigation so the load's lifecycle events are all seen
+    quiet = await watch_lifecycle(page)
+    
+    # Set longer timeouts for dynamic content
+    page.set_default_timeout(60000)
+    page.set_default_navigation_timeout(60000)
+    
+    return page, quiet
+
+async def worker(context, state):
+    """Pull (url, depth) tasks off the shared queue until cancelled, reusing one page"""
+    current = None  # This worker's (page, network_quiet) pair
+    crashed = set()  # Pages whose renderer died; they stay open but can no longer load anything
+    try:
+        while True:
+            current_url, depth = await state.queue.get()
+            try:
+                # A redirect from another claimed URL may already have crawled this page
+                if canonicalize_url(current_url) in state.visited:
+                    continue
+                async with state.semaphore:
+                    if state.use_http:
+                        # Plain HTTP fetches need no browser page; release this worker's one
+                        if current is not None:
+                            await current[0].close()
+                            current = None
+                    else:
+                        try:
+                            current = await ensure_live_page(current, crashed, lambda: open_worker_page(context))
+                        except Exception as e:
+                            print(f"[ERROR] {current_url}: could not open a page: {e}")
+                            save_page(state, {
+                                "url": current_url,
+                                "title": "Error loading page",
+                                "description": str(e),
+                                "depth": depth,
+                                "error": True
+                            })
+                            continue
+                    page, quiet = current or (None, None)
+                    await crawl(page, quiet, state, current_url, depth)
+            finally:
+                state.visited.add(canonicalize_url(current_url))
+                state.queue.task_done()
     finally:
-        await page.close()
+        if current is not None:
+            await current[0].close()
 
-async def main(start_url, max_depth=3):
+async def main(start_url, max_depth=3, profile_dir=DEFAULT_PROFILE_DIR):
     parsed_url = urlparse(start_url)
-    base_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
+    base_url = f"{parsed_url.scheme}://{parsed_url.netloc.lower()}"
     
     print(f"Starting crawl of: {start_url}")
     print(f"Base URL: {base_url}")
     print(f"Max depth: {max_depth}")
     print("-" * 50)
     
-    async with async_playwright() as p:
-        # Use a more realistic browser context
-        browser = await p.chromium.launch(
-            headless=True,
-            args=[
-                '--disable-blink-features=AutomationControlled',
-                '--disable-dev-shm-usage',
-                '--no-sandbox'
-            ]
-        )
-        
-        context = await browser.new_context(
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            viewport={'width': 1920, 'height': 1080}
-        )
-        
-        # Enable JavaScript
-        await context.add_init_script("delete Object.getPrototypeOf(navigator).webdriver")
-        
-        await crawl(context, base_url, start_url, max_depth=max_depth)
-        await browser.close()
+    output_file = "sitemap.ndjson"
     
-    # Save results
-    output_file = "sitemap.json"
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(sitemap, f, indent=2, ensure_ascii=False)
+    # Stream one JSON record per page so memory stays flat however large the crawl gets
+    with open(output_file, "wb") as out:
+        async with async_playwright() as p:
+            # Use a more realistic browser context; the persistent profile keeps DNS,
+            # HTTP and service-worker caches warm across runs (resources are blocked per page
+            # over CDP rather than routed, because routing would switch the HTTP cache off)
+            context = await p.chromium.launch_persistent_context(
+                os.path.join(profile_dir, parsed_url.netloc.lower().replace(':', '_')),
+                headless=True,
+                args=[
+                    '--disable-blink-features=AutomationControlled',
+                    '--disable-dev-shm-usage',
+                    '--no-sandbox',
+                    '--blink-settings=imagesEnabled=false'  # Also catches images without a file extension
+                ],
+                user_agent=USER_AGENT,
+                viewport={'width': 1920, 'height': 1080}
+            )
+            
+            # Workers open their own configured pages; the blank startup page would only hold a renderer
+            for blank_page in list(context.pages):
+                await blank_page.close()
+            
+            # Enable JavaScript
+            await context.add_init_script("delete Object.getPrototypeOf(navigator).webdriver")
+            
+            client = httpx.AsyncClient(http2=True, follow_redirects=True, timeout=15, headers={'User-Agent': USER_AGENT})
+            state = SiteCrawlState(base_url, max_depth, out, client=client)
+            state.claimed.add(canonicalize_url(start_url))
+            state.queue.put_nowait((start_url, 0))
+            
+            workers = [
+                asyncio.create_task(worker(context, state))
+                for _ in range(MAX_PARALLEL_PAGES)
+            ]
+            await state.queue.join()
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            
+            await client.aclose()
+            await context.close()
     
+    stats = state.stats
     print(f"\nCrawl completed!")
-    print(f"Total pages crawled: {len(sitemap)}")
+    print(f"Total pages crawled: {stats['total']}")
     print(f"Results saved to: {output_file}")
     
     # Print summary
-    successful_pages = [p for p in sitemap if not p.get('error', False)]
-    error_pages = [p for p in sitemap if p.get('error', False)]
+    print(f"Successful: {stats['successful']}")
+    print(f"Aliases: {stats['aliases']}")
+    print(f"Errors: {stats['errors']}")
     
-    print(f"Successful: {len(successful_pages)}")
-    print(f"Errors: {len(error_pages)}")
+    lost = lost_to_filter(state)
+    if lost:
+        print(f"Skipped by URL filter false positives: {len(lost)}")
+        for url in lost[:10]:
+            print(f"  {url}")
 
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) < 2:
-        print("Usage: python dynamic_crawler.py <URL> [max_depth]")
-        print("Example: python dynamic_crawler.py https://your-gatsby-site.com 2")
-    else:
-        url = sys.argv[1]
-        max_depth = int(sys.argv[2]) if len(sys.argv) > 2 else 3
-        asyncio.run(main(url, max_depth))
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Crawl a website and save its sitemap",
+        epilog="Example: python dynamic_crawler.py https://your-gatsby-site.com 2"
+    )
+    parser.add_argument("url", help="URL to start crawling from")
+    parser.add_argument("max_depth", nargs="?", type=int, default=3, help="maximum link depth (default: 3)")
+    parser.add_argument("--profile-dir", default=DEFAULT_PROFILE_DIR,
+                        help=f"directory holding one browser profile per site, reused between crawls (default: {DEFAULT_PROFILE_DIR})")
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.max_depth, args.profile_dir))
\ No newline at end of file